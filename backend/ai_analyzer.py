@@ -6,6 +6,8 @@ import os
 from typing import List, Dict
 from datetime import datetime
 
+from topk import top_domains
+
 # 注意：實際使用時需要安裝 google-generativeai
 # pip install google-generativeai
 
@@ -61,16 +63,8 @@ def calculate_stats(activities: List[Dict]) -> Dict:
     distraction_seconds = sum(a['duration'] for a in activities if a['category'] == 'distraction')
     neutral_seconds = sum(a['duration'] for a in activities if a['category'] == 'neutral')
     
-    # 統計各網站時間
-    site_times = {}
-    for activity in activities:
-        domain = activity['domain']
-        if domain not in site_times:
-            site_times[domain] = {'duration': 0, 'category': activity['category']}
-        site_times[domain]['duration'] += activity['duration']
-    
-    # 排序取前5名
-    top_sites = sorted(site_times.items(), key=lambda x: x[1]['duration'], reverse=True)[:5]
+    # 取時間最長的前5名網站（網域不多時為精確值，否則以固定記憶體近似）
+    top_sites = top_domains(activities, k=5)
     
     return {
         'total_hours': total_seconds / 3600,
@@ -0,0 +1,85 @@
+"""
+啟動效能測試 - 量測後端從啟動程序到第一個請求成功回應的時間
+
+用法：
+    python bench_startup.py            # 兩種模式各跑 5 次
+    python bench_startup.py --runs 10
+"""
+
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _get(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            response.read()
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError):
+        return False
+
+
+def time_to_first_request(fast_startup: bool, path: str = "/", timeout: float = 30.0) -> float:
+    """啟動一個 uvicorn 程序並輪詢 path，回傳第一次成功回應所花的秒數"""
+    port = _free_port()
+    env = dict(os.environ, ECHOFOCUS_FAST_STARTUP="1" if fast_startup else "0")
+    started = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR,
+        env=env,
+    )
+    try:
+        url = f"http://127.0.0.1:{port}{path}"
+        while time.perf_counter() - started < timeout:
+            if _get(url):
+                return time.perf_counter() - started
+            time.sleep(0.005)
+        raise TimeoutError(f"後端在 {timeout} 秒內沒有回應")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def time_import() -> float:
+    """在新程序中只 import main，回傳秒數"""
+    started = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "import main"], cwd=BACKEND_DIR, check=True)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    imports = [time_import() for _ in range(args.runs)]
+    print(f"import main:            中位數 {statistics.median(imports) * 1000:7.1f} ms")
+    for fast in (False, True):
+        for path in ("/health", "/"):
+            samples = [time_to_first_request(fast, path) for _ in range(args.runs)]
+            mode = "fast" if fast else "eager"
+            print(
+                f"{mode:5} 首次請求 {path:8}: 中位數 {statistics.median(samples) * 1000:7.1f} ms"
+                f"  (min {min(samples) * 1000:.1f} / max {max(samples) * 1000:.1f})"
+            )
+
+
+if __name__ == "__main__":
+    main()
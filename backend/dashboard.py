@@ -0,0 +1,271 @@
+"""
+儀表板頁面 - HTML 在第一次請求時才組裝並預先壓縮，之後直接從記憶體回傳
+"""
+
+import gzip
+import hashlib
+from functools import lru_cache
+from typing import NamedTuple
+
+DASHBOARD_HTML = """<!DOCTYPE html>
+<html lang="zh-TW">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Productivity Tracker Dashboard</title>
+    <style>
+        * {
+            margin: 0;
+            padding: 0;
+            box-sizing: border-box;
+        }
+        
+        body {
+            font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            min-height: 100vh;
+            padding: 40px 20px;
+        }
+        
+        .container {
+            max-width: 1200px;
+            margin: 0 auto;
+        }
+        
+        .header {
+            text-align: center;
+            color: white;
+            margin-bottom: 40px;
+        }
+        
+        h1 {
+            font-size: 42px;
+            margin-bottom: 10px;
+        }
+        
+        .subtitle {
+            font-size: 18px;
+            opacity: 0.9;
+        }
+        
+        .dashboard {
+            background: white;
+            border-radius: 20px;
+            padding: 40px;
+            box-shadow: 0 20px 60px rgba(0,0,0,0.3);
+        }
+        
+        .stats-grid {
+            display: grid;
+            grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
+            gap: 20px;
+            margin-bottom: 40px;
+        }
+        
+        .stat-card {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            padding: 30px;
+            border-radius: 15px;
+            text-align: center;
+        }
+        
+        .stat-value {
+            font-size: 48px;
+            font-weight: bold;
+            margin-bottom: 10px;
+        }
+        
+        .stat-label {
+            font-size: 16px;
+            opacity: 0.9;
+        }
+        
+        .activity-list {
+            margin-top: 30px;
+        }
+        
+        .activity-list h2 {
+            color: #333;
+            margin-bottom: 20px;
+        }
+        
+        .activity-item {
+            display: flex;
+            justify-content: space-between;
+            align-items: center;
+            padding: 15px;
+            background: #f5f5f5;
+            border-radius: 10px;
+            margin-bottom: 10px;
+        }
+        
+        .activity-domain {
+            font-weight: 600;
+            color: #333;
+        }
+        
+        .activity-time {
+            color: #666;
+        }
+        
+        .category-badge {
+            padding: 5px 15px;
+            border-radius: 20px;
+            font-size: 12px;
+            font-weight: 600;
+            text-transform: uppercase;
+        }
+        
+        .productive {
+            background: #4ade80;
+            color: white;
+        }
+        
+        .distraction {
+            background: #ef4444;
+            color: white;
+        }
+        
+        .neutral {
+            background: #94a3b8;
+            color: white;
+        }
+        
+        .btn {
+            background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
+            color: white;
+            border: none;
+            padding: 12px 30px;
+            border-radius: 8px;
+            font-size: 16px;
+            font-weight: 600;
+            cursor: pointer;
+            margin-top: 20px;
+        }
+        
+        .btn:hover {
+            transform: translateY(-2px);
+            box-shadow: 0 4px 12px rgba(102, 126, 234, 0.4);
+        }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <div class="header">
+            <h1>📊 Productivity Dashboard</h1>
+            <p class="subtitle">追蹤你的生產力旅程</p>
+        </div>
+        
+        <div class="dashboard">
+            <div class="stats-grid">
+                <div class="stat-card">
+                    <div class="stat-value" id="totalHours">0</div>
+                    <div class="stat-label">總追蹤時數</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-value" id="productiveHours">0</div>
+                    <div class="stat-label">生產力時數</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-value" id="distractionHours">0</div>
+                    <div class="stat-label">分心時數</div>
+                </div>
+                <div class="stat-card">
+                    <div class="stat-value" id="focusScore">0%</div>
+                    <div class="stat-label">專注分數</div>
+                </div>
+            </div>
+            
+            <div class="activity-list">
+                <h2>最近活動</h2>
+                <div id="activitiesList">
+                    <p style="text-align: center; color: #999; padding: 40px;">
+                        暫無活動數據<br>
+                        <small>安裝 Chrome Extension 開始追蹤</small>
+                    </p>
+                </div>
+            </div>
+            
+            <button class="btn" onclick="loadData()">刷新數據</button>
+        </div>
+    </div>
+    
+    <script>
+        async function loadData() {
+            try {
+                const response = await fetch('/api/activity/summary/1');
+                const data = await response.json();
+                
+                // 更新統計
+                document.getElementById('totalHours').textContent = 
+                    data.total_hours.toFixed(1);
+                document.getElementById('productiveHours').textContent = 
+                    data.productive_hours.toFixed(1);
+                document.getElementById('distractionHours').textContent = 
+                    data.distraction_hours.toFixed(1);
+                document.getElementById('focusScore').textContent = 
+                    data.focus_score + '%';
+                
+                // 更新活動列表
+                const activitiesList = document.getElementById('activitiesList');
+                if (data.recent_activities.length > 0) {
+                    activitiesList.innerHTML = data.recent_activities.map(activity => `
+                        <div class="activity-item">
+                            <div>
+                                <div class="activity-domain">${activity.domain}</div>
+                                <div class="activity-time">${new Date(activity.timestamp).toLocaleString('zh-TW')}</div>
+                            </div>
+                            <div>
+                                <span class="category-badge ${activity.category}">${getCategoryText(activity.category)}</span>
+                                <span style="margin-left: 10px; color: #666;">${formatDuration(activity.duration)}</span>
+                            </div>
+                        </div>
+                    `).join('');
+                }
+            } catch (error) {
+                console.error('載入數據失敗:', error);
+            }
+        }
+        
+        function getCategoryText(category) {
+            const map = {
+                'productive': '生產力',
+                'distraction': '分心',
+                'neutral': '中性'
+            };
+            return map[category] || category;
+        }
+        
+        function formatDuration(seconds) {
+            const minutes = Math.floor(seconds / 60);
+            if (minutes < 60) return `${minutes}分鐘`;
+            const hours = Math.floor(minutes / 60);
+            const mins = minutes % 60;
+            return `${hours}小時${mins}分鐘`;
+        }
+        
+        // 頁面載入時自動讀取數據
+        loadData();
+    </script>
+</body>
+</html>
+"""
+
+
+class DashboardAsset(NamedTuple):
+    body: bytes
+    gzip_body: bytes
+    etag: str
+
+
+@lru_cache(maxsize=1)
+def get_dashboard() -> DashboardAsset:
+    """編碼、壓縮儀表板 HTML 並計算 ETag，只在第一次呼叫時執行"""
+    body = DASHBOARD_HTML.encode("utf-8")
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return DashboardAsset(
+        body=body,
+        gzip_body=gzip.compress(body, compresslevel=9, mtime=0),
+        etag=f'"{digest}"',
+    )
@@ -0,0 +1,96 @@
+"""
+資料匯出模組 - 以串流方式輸出 CSV / NDJSON，不在記憶體中組出完整結果
+"""
+
+import csv
+import io
+import json
+import zlib
+from datetime import datetime, timezone
+from typing import Dict, Iterator, Optional
+
+EXPORT_FIELDS = ["timestamp", "domain", "url", "duration", "category"]
+
+# 每累積這麼多位元組才送出一個 chunk，避免過多細碎的寫入
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_timestamp(value: str) -> datetime:
+    """解析 ISO 時間字串，統一轉為 naive UTC 以便比較"""
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return ts
+
+
+def iter_user_activities(
+    store,
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+) -> Iterator[Dict]:
+    """
+    依寫入順序走訪某用戶的活動，可依時間區間 [start, end) 過濾
+
+    store 為 snapshot.ActivityLog，只會走訪該用戶的列，且只有落在區間內的列才會組成 dict。
+    指定時間區間時，時間格式無法解析的活動會被略過，不會中斷串流。
+    """
+    if start is not None and start.tzinfo is not None:
+        start = start.astimezone(timezone.utc).replace(tzinfo=None)
+    if end is not None and end.tzinfo is not None:
+        end = end.astimezone(timezone.utc).replace(tzinfo=None)
+    if start is None and end is None:
+        return store.iter_user(user_id)
+
+    def in_range(timestamp: str) -> bool:
+        try:
+            ts = parse_timestamp(timestamp)
+        except ValueError:
+            return False
+        return (start is None or ts >= start) and (end is None or ts < end)
+
+    return store.iter_user(user_id, keep=in_range)
+
+
+def iter_csv(activities: Iterator[Dict]) -> Iterator[bytes]:
+    """將活動轉為 CSV，每次輸出約 CHUNK_SIZE 大小的 bytes"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    for activity in activities:
+        writer.writerow([activity.get(field, "") for field in EXPORT_FIELDS])
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(activities: Iterator[Dict]) -> Iterator[bytes]:
+    """將活動轉為 NDJSON（每行一筆 JSON），每次輸出約 CHUNK_SIZE 大小的 bytes"""
+    parts = []
+    size = 0
+    for activity in activities:
+        line = json.dumps(
+            {field: activity.get(field) for field in EXPORT_FIELDS},
+            ensure_ascii=False,
+        ) + "\n"
+        parts.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield "".join(parts).encode("utf-8")
+            parts = []
+            size = 0
+    if parts:
+        yield "".join(parts).encode("utf-8")
+
+
+def gzip_stream(chunks: Iterator[bytes], level: int = 6) -> Iterator[bytes]:
+    """即時以 gzip 壓縮串流，記憶體用量只取決於壓縮視窗大小"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # 31 = gzip 標頭
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
@@ -1,15 +1,35 @@
-from fastapi import FastAPI, HTTPException
+import time
+
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import HTMLResponse
-from pydantic import BaseModel
+from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from pydantic import BaseModel, ValidationError, conint
 from typing import List, Optional
-from datetime import datetime, timedelta
-import json
-from pathlib import Path
+from datetime import date, datetime
+import importlib
+import os
+
+from starlette.concurrency import run_in_threadpool
+
+import exporter
+import ratelimit
+import snapshot
+import topk
 
 app = FastAPI(title="Productivity Tracker API")
 
+# 快速啟動模式：AI 分析與儀表板等選用模組延後到第一次使用時才載入；
+# 關閉時（預設）則在啟動階段預先載入，讓第一個請求不必等待，代價是啟動稍慢
+FAST_STARTUP = os.environ.get("ECHOFOCUS_FAST_STARTUP") == "1"
+startup_timings = {}
+
+# 批次寫入限流；設定 ECHOFOCUS_RATE_LIMIT_CONFIG 指向 JSON 檔即可在執行中調整參數
+limiter = ratelimit.RateLimiter(config_path=os.environ.get("ECHOFOCUS_RATE_LIMIT_CONFIG"))
+app.add_middleware(ratelimit.RateLimitMiddleware, limiter=limiter)
+
 # 允許 CORS（Chrome Extension 需要）
 app.add_middleware(
     CORSMiddleware,
@@ -20,17 +40,26 @@ app.add_middleware(
 )
 
 # 資料模型
+# 快照以 int64 儲存 user_id、duration 與各用戶的秒數總和，超出範圍的值在寫入時就拒絕；
+# user_id 只接受 JSON 整數（不轉換 "1" 或 1.0），與限流中介層認定的用戶一致
+Int64 = conint(strict=True, ge=-2**63, le=2**63 - 1)
+Duration = conint(ge=0, le=2**31 - 1)
+
 class Activity(BaseModel):
     url: str
     domain: str
-    duration: int  # 秒數
+    duration: Duration  # 秒數
     timestamp: str
     category: str  # 'productive', 'distraction', 'neutral'
 
 class BatchActivityLog(BaseModel):
-    user_id: int
+    user_id: Int64
     activities: List[Activity]
 
+# 批次寫入的 body 已由限流中介層解析，路由改為自行驗證；API 文件的 request body 另外指定
+BATCH_SCHEMA = BatchActivityLog.model_json_schema()
+BATCH_SCHEMA["properties"]["activities"]["items"] = BATCH_SCHEMA.pop("$defs")["Activity"]
+
 class User(BaseModel):
     id: int
     email: str
@@ -41,267 +70,169 @@ users_db = {
     1: {"id": 1, "email": "demo@example.com", "name": "Demo User"}
 }
 
-activities_db = []
+activities_db = snapshot.ActivityLog()
+
+# 熱門網域統計：每位用戶一份總計與最近幾天的每日統計，於寫入時更新並隨快照保存
+TOPK_EPSILON = float(os.environ.get("ECHOFOCUS_TOPK_EPSILON", topk.DEFAULT_EPSILON))
+TOPK_RETENTION_DAYS = int(
+    os.environ.get("ECHOFOCUS_TOPK_RETENTION_DAYS", topk.DEFAULT_RETENTION_DAYS)
+)
+domain_trackers = topk.DomainTrackers(TOPK_EPSILON, TOPK_RETENTION_DAYS)
+
+def track_domains(activity: dict):
+    """將一筆活動計入該用戶的總計與當日熱門網域統計"""
+    try:
+        day = datetime.fromisoformat(activity['timestamp']).date()
+    except ValueError:
+        day = None
+    domain_trackers.track(
+        activity['user_id'], activity['domain'], activity['duration'],
+        activity['category'], day,
+    )
+
+# 快照設定：設定 ECHOFOCUS_SNAPSHOT_PATH 後，啟動時載入、關閉時寫回
+SNAPSHOT_PATH = os.environ.get("ECHOFOCUS_SNAPSHOT_PATH")
+SNAPSHOT_VERIFY = os.environ.get("ECHOFOCUS_SNAPSHOT_VERIFY") == "1"
+
+# state: none / loaded / corrupt（已移開損毀檔）/ unreadable（無法讀取，不覆寫）
+snapshot_status = {"state": "none"}
+
+def _quarantine_snapshot(error: Exception):
+    """將損毀的快照檔改名保留，之後的寫出不會覆蓋它"""
+    target = f"{SNAPSHOT_PATH}.corrupt-{int(time.time())}"
+    try:
+        os.replace(SNAPSHOT_PATH, target)
+    except OSError as e:
+        print(f"⚠️ 快照損毀且無法移開，停用快照寫出: {error} / {e}")
+        snapshot_status.update(state="unreadable", error=str(error))
+        return
+    print(f"⚠️ 快照損毀，已移至 {target}，以之後寫入的資料繼續運作: {error}")
+    snapshot_status.update(state="corrupt", error=str(error), moved_to=target)
+
+def _discard_snapshot(error: snapshot.SnapshotError):
+    """讀到損毀的區塊時捨棄快照資料並移開檔案（只處理一次）"""
+    if snapshot_status["state"] != "loaded":
+        return
+    activities_db.detach_base()
+    domain_trackers.detach_source()
+    _quarantine_snapshot(error)
+
+@app.on_event("startup")
+async def load_snapshot():
+    """啟動時以 mmap 載入快照，資料頁與各區塊的 CRC32 都在第一次讀取時才處理"""
+    global activities_db
+    if not SNAPSHOT_PATH or not os.path.exists(SNAPSHOT_PATH):
+        return
+    try:
+        activities_db = snapshot.load(SNAPSHOT_PATH, verify=SNAPSHOT_VERIFY)
+    except snapshot.SnapshotError as e:
+        _quarantine_snapshot(e)
+        return
+    except OSError as e:
+        print(f"⚠️ 無法讀取快照，停用快照寫出以免覆蓋: {e}")
+        snapshot_status.update(state="unreadable", error=str(e))
+        return
+    print(f"📦 已載入快照: {len(activities_db)} 筆活動")
+    snapshot_status["state"] = "loaded"
+    domain_trackers.source = activities_db.base
+
+def _save_all() -> int:
+    count = len(activities_db)
+    return snapshot.save(
+        SNAPSHOT_PATH, (activities_db[i] for i in range(count)), domain_trackers.export()
+    )
+
+async def write_snapshot() -> int:
+    """寫出快照；寫出途中讀到損毀的區塊時捨棄快照資料，只寫出之後寫入的活動"""
+    if snapshot_status["state"] == "unreadable":
+        raise HTTPException(status_code=409, detail="快照檔無法讀取，已停用寫出以免覆蓋")
+    try:
+        return await run_in_threadpool(_save_all)
+    except snapshot.SnapshotError as e:
+        _discard_snapshot(e)
+        if snapshot_status["state"] == "unreadable":
+            raise HTTPException(status_code=409, detail="快照檔無法讀取，已停用寫出以免覆蓋")
+        return await run_in_threadpool(_save_all)
+
+@app.exception_handler(snapshot.SnapshotError)
+async def snapshot_error_handler(request: Request, exc: snapshot.SnapshotError):
+    """讀到損毀的快照區塊：捨棄快照資料，這次請求回傳 503，之後的請求只使用新資料"""
+    _discard_snapshot(exc)
+    return JSONResponse(status_code=503, content={"detail": f"快照資料損毀: {exc}"})
+
+@app.on_event("startup")
+async def record_startup():
+    """記錄啟動耗時；非快速模式下預先載入選用模組"""
+    if not FAST_STARTUP:
+        importlib.import_module("ai_analyzer")
+        importlib.import_module("dashboard").get_dashboard()
+    startup_timings["ready_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+
+@app.on_event("shutdown")
+async def save_snapshot():
+    """關閉時將活動寫回快照"""
+    if not SNAPSHOT_PATH:
+        return
+    try:
+        saved = await write_snapshot()
+        print(f"📦 已寫出快照: {saved} 筆活動")
+    except (HTTPException, snapshot.SnapshotError, OSError) as e:
+        print(f"⚠️ 快照寫出失敗: {getattr(e, 'detail', e)}")
 
 # API 端點
 
 @app.get("/")
-async def root():
-    """主頁 - 簡單的儀表板"""
-    html_content = """
-    <!DOCTYPE html>
-    <html lang="zh-TW">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>Productivity Tracker Dashboard</title>
-        <style>
-            * {
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }
-            
-            body {
-                font-family: -apple-system, BlinkMacSystemFont, 'Segoe UI', sans-serif;
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                min-height: 100vh;
-                padding: 40px 20px;
-            }
-            
-            .container {
-                max-width: 1200px;
-                margin: 0 auto;
-            }
-            
-            .header {
-                text-align: center;
-                color: white;
-                margin-bottom: 40px;
-            }
-            
-            h1 {
-                font-size: 42px;
-                margin-bottom: 10px;
-            }
-            
-            .subtitle {
-                font-size: 18px;
-                opacity: 0.9;
-            }
-            
-            .dashboard {
-                background: white;
-                border-radius: 20px;
-                padding: 40px;
-                box-shadow: 0 20px 60px rgba(0,0,0,0.3);
-            }
-            
-            .stats-grid {
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-                gap: 20px;
-                margin-bottom: 40px;
-            }
-            
-            .stat-card {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                padding: 30px;
-                border-radius: 15px;
-                text-align: center;
-            }
-            
-            .stat-value {
-                font-size: 48px;
-                font-weight: bold;
-                margin-bottom: 10px;
-            }
-            
-            .stat-label {
-                font-size: 16px;
-                opacity: 0.9;
-            }
-            
-            .activity-list {
-                margin-top: 30px;
-            }
-            
-            .activity-list h2 {
-                color: #333;
-                margin-bottom: 20px;
-            }
-            
-            .activity-item {
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                padding: 15px;
-                background: #f5f5f5;
-                border-radius: 10px;
-                margin-bottom: 10px;
-            }
-            
-            .activity-domain {
-                font-weight: 600;
-                color: #333;
-            }
-            
-            .activity-time {
-                color: #666;
-            }
-            
-            .category-badge {
-                padding: 5px 15px;
-                border-radius: 20px;
-                font-size: 12px;
-                font-weight: 600;
-                text-transform: uppercase;
-            }
-            
-            .productive {
-                background: #4ade80;
-                color: white;
-            }
-            
-            .distraction {
-                background: #ef4444;
-                color: white;
-            }
-            
-            .neutral {
-                background: #94a3b8;
-                color: white;
-            }
-            
-            .btn {
-                background: linear-gradient(135deg, #667eea 0%, #764ba2 100%);
-                color: white;
-                border: none;
-                padding: 12px 30px;
-                border-radius: 8px;
-                font-size: 16px;
-                font-weight: 600;
-                cursor: pointer;
-                margin-top: 20px;
-            }
-            
-            .btn:hover {
-                transform: translateY(-2px);
-                box-shadow: 0 4px 12px rgba(102, 126, 234, 0.4);
-            }
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <h1>📊 Productivity Dashboard</h1>
-                <p class="subtitle">追蹤你的生產力旅程</p>
-            </div>
-            
-            <div class="dashboard">
-                <div class="stats-grid">
-                    <div class="stat-card">
-                        <div class="stat-value" id="totalHours">0</div>
-                        <div class="stat-label">總追蹤時數</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-value" id="productiveHours">0</div>
-                        <div class="stat-label">生產力時數</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-value" id="distractionHours">0</div>
-                        <div class="stat-label">分心時數</div>
-                    </div>
-                    <div class="stat-card">
-                        <div class="stat-value" id="focusScore">0%</div>
-                        <div class="stat-label">專注分數</div>
-                    </div>
-                </div>
-                
-                <div class="activity-list">
-                    <h2>最近活動</h2>
-                    <div id="activitiesList">
-                        <p style="text-align: center; color: #999; padding: 40px;">
-                            暫無活動數據<br>
-                            <small>安裝 Chrome Extension 開始追蹤</small>
-                        </p>
-                    </div>
-                </div>
-                
-                <button class="btn" onclick="loadData()">刷新數據</button>
-            </div>
-        </div>
-        
-        <script>
-            async function loadData() {
-                try {
-                    const response = await fetch('/api/activity/summary/1');
-                    const data = await response.json();
-                    
-                    // 更新統計
-                    document.getElementById('totalHours').textContent = 
-                        data.total_hours.toFixed(1);
-                    document.getElementById('productiveHours').textContent = 
-                        data.productive_hours.toFixed(1);
-                    document.getElementById('distractionHours').textContent = 
-                        data.distraction_hours.toFixed(1);
-                    document.getElementById('focusScore').textContent = 
-                        data.focus_score + '%';
-                    
-                    // 更新活動列表
-                    const activitiesList = document.getElementById('activitiesList');
-                    if (data.recent_activities.length > 0) {
-                        activitiesList.innerHTML = data.recent_activities.map(activity => `
-                            <div class="activity-item">
-                                <div>
-                                    <div class="activity-domain">${activity.domain}</div>
-                                    <div class="activity-time">${new Date(activity.timestamp).toLocaleString('zh-TW')}</div>
-                                </div>
-                                <div>
-                                    <span class="category-badge ${activity.category}">${getCategoryText(activity.category)}</span>
-                                    <span style="margin-left: 10px; color: #666;">${formatDuration(activity.duration)}</span>
-                                </div>
-                            </div>
-                        `).join('');
-                    }
-                } catch (error) {
-                    console.error('載入數據失敗:', error);
-                }
-            }
-            
-            function getCategoryText(category) {
-                const map = {
-                    'productive': '生產力',
-                    'distraction': '分心',
-                    'neutral': '中性'
-                };
-                return map[category] || category;
-            }
-            
-            function formatDuration(seconds) {
-                const minutes = Math.floor(seconds / 60);
-                if (minutes < 60) return `${minutes}分鐘`;
-                const hours = Math.floor(minutes / 60);
-                const mins = minutes % 60;
-                return `${hours}小時${mins}分鐘`;
-            }
-            
-            // 頁面載入時自動讀取數據
-            loadData();
-        </script>
-    </body>
-    </html>
-    """
-    return HTMLResponse(content=html_content)
+async def root(request: Request):
+    """主頁 - 簡單的儀表板（預先壓縮、支援 ETag 快取）"""
+    import dashboard
 
-@app.post("/api/activity/batch")
-async def log_batch_activities(data: BatchActivityLog):
+    asset = dashboard.get_dashboard()
+    headers = {
+        "ETag": asset.etag,
+        "Cache-Control": "public, max-age=300",
+        "Vary": "Accept-Encoding",
+    }
+    if request.headers.get("if-none-match") == asset.etag:
+        return Response(status_code=304, headers=headers)
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        return HTMLResponse(content=asset.gzip_body, headers=headers)
+    return HTMLResponse(content=asset.body, headers=headers)
+
+async def parse_batch(request: Request) -> BatchActivityLog:
+    """驗證批次寫入的 body，優先使用限流中介層解析過的結果；錯誤時回傳與 FastAPI 相同格式的 422"""
+    payload = getattr(request.state, ratelimit.PARSED_BODY, None)
+    if payload is None:
+        body = await request.body()
+        try:
+            payload = ratelimit.parse_json(body)
+        except (ValueError, RecursionError) as e:
+            raise RequestValidationError([{
+                "type": "json_invalid",
+                "loc": ("body", getattr(e, "pos", 0)),
+                "msg": "JSON decode error",
+                "input": {},
+                "ctx": {"error": getattr(e, "msg", str(e))},
+            }], body=body)
+    try:
+        return BatchActivityLog.model_validate(payload)
+    except ValidationError as e:
+        raise RequestValidationError(
+            [{**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)],
+            body=payload,
+        )
+
+@app.post("/api/activity/batch", openapi_extra={
+    "requestBody": {"required": True, "content": {"application/json": {"schema": BATCH_SCHEMA}}},
+})
+async def log_batch_activities(request: Request):
     """批次記錄活動"""
+    data = await parse_batch(request)
     for activity in data.activities:
         activity_dict = activity.dict()
         activity_dict['user_id'] = data.user_id
         activities_db.append(activity_dict)
+        track_domains(activity_dict)
     
     return {
         "success": True,
@@ -312,9 +243,9 @@ async def log_batch_activities(data: BatchActivityLog):
 @app.get("/api/activity/summary/{user_id}")
 async def get_activity_summary(user_id: int):
     """獲取用戶活動總結"""
-    user_activities = [a for a in activities_db if a.get('user_id') == user_id]
+    totals = activities_db.user_totals(user_id)
     
-    if not user_activities:
+    if not totals['count']:
         return {
             "total_hours": 0,
             "productive_hours": 0,
@@ -323,15 +254,15 @@ async def get_activity_summary(user_id: int):
             "recent_activities": []
         }
     
-    # 計算統計
-    total_seconds = sum(a['duration'] for a in user_activities)
-    productive_seconds = sum(a['duration'] for a in user_activities if a['category'] == 'productive')
-    distraction_seconds = sum(a['duration'] for a in user_activities if a['category'] == 'distraction')
+    # 計算統計（來自快照中的彙總與之後寫入的累計，不需走訪活動）
+    total_seconds = totals['total_seconds']
+    productive_seconds = totals['productive_seconds']
+    distraction_seconds = totals['distraction_seconds']
     
     focus_score = int((productive_seconds / total_seconds * 100)) if total_seconds > 0 else 0
     
     # 取最近 10 筆活動
-    recent = sorted(user_activities, key=lambda x: x['timestamp'], reverse=True)[:10]
+    recent = activities_db.latest(user_id, 10)
     
     return {
         "total_hours": total_seconds / 3600,
@@ -341,15 +272,53 @@ async def get_activity_summary(user_id: int):
         "recent_activities": recent
     }
 
+@app.get("/api/activity/top-domains/{user_id}")
+async def get_top_domains(
+    user_id: int,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    k: int = 5,
+):
+    """
+    獲取停留時間最長的網域；指定 start / end 時合併區間內（含）每日的統計
+
+    每日統計只保留最近 ECHOFOCUS_TOPK_RETENTION_DAYS 天，區間超出保留範圍
+    （包括只指定 end）時結果缺少那些天；快照損毀被捨棄時，統計只涵蓋之後寫入的資料。
+    這兩種情況 partial 都為 true。
+    """
+    tracker = domain_trackers.query(user_id, start, end)
+    partial = (
+        not domain_trackers.covers(start, end)
+        or snapshot_status["state"] in ("corrupt", "unreadable")
+    )
+
+    return {
+        "exact": tracker.exact and not partial,
+        "partial": partial,
+        "total_seconds": tracker.total,
+        "domains": [
+            {
+                "domain": domain,
+                "seconds": seconds,
+                "max_error_seconds": tracker.error(domain),
+                "category": tracker.labels.get(domain),
+            }
+            for domain, seconds in tracker.top(k)
+        ]
+    }
+
 @app.get("/api/activity/today/{user_id}")
 async def get_today_activities(user_id: int):
     """獲取今日活動"""
     today = datetime.now().date()
-    user_activities = [
-        a for a in activities_db 
-        if a.get('user_id') == user_id and 
-        datetime.fromisoformat(a['timestamp']).date() == today
-    ]
+
+    def is_today(timestamp: str) -> bool:
+        try:
+            return datetime.fromisoformat(timestamp).date() == today
+        except ValueError:
+            return False
+
+    user_activities = list(activities_db.iter_user(user_id, keep=is_today))
     
     return {
         "date": today.isoformat(),
@@ -357,6 +326,56 @@ async def get_today_activities(user_id: int):
         "count": len(user_activities)
     }
 
+def _export_response(chunks, media_type: str, filename: str, gzip: bool):
+    """包裝匯出串流；同步 generator 會在 threadpool 中執行，不阻塞 event loop"""
+    if gzip:
+        chunks = exporter.gzip_stream(chunks)
+        media_type = "application/gzip"
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/api/export/{user_id}/csv")
+async def export_csv(
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    gzip: bool = False,
+):
+    """以 CSV 串流匯出用戶活動，可用 start / end 過濾時間區間"""
+    activities = exporter.iter_user_activities(activities_db, user_id, start, end)
+    return _export_response(
+        exporter.iter_csv(activities), "text/csv",
+        f"echofocus-{user_id}.csv", gzip,
+    )
+
+@app.get("/api/export/{user_id}/ndjson")
+async def export_ndjson(
+    user_id: int,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    gzip: bool = False,
+):
+    """以 NDJSON 串流匯出用戶活動，可用 start / end 過濾時間區間"""
+    activities = exporter.iter_user_activities(activities_db, user_id, start, end)
+    return _export_response(
+        exporter.iter_ndjson(activities), "application/x-ndjson",
+        f"echofocus-{user_id}.ndjson", gzip,
+    )
+
+@app.get("/api/ai/analyze/{user_id}")
+async def analyze_today(user_id: int):
+    """以今日活動產生 AI 分析（模組在第一次呼叫時才載入）"""
+    import ai_analyzer
+
+    today = (await get_today_activities(user_id))["activities"]
+    if not today:
+        raise HTTPException(status_code=404, detail="今日暫無活動數據")
+    return {"analysis": ai_analyzer.analyze_productivity(today)}
+
 @app.get("/api/users/{user_id}")
 async def get_user(user_id: int):
     """獲取用戶資訊"""
@@ -365,15 +384,28 @@ async def get_user(user_id: int):
         raise HTTPException(status_code=404, detail="用戶不存在")
     return user
 
+@app.post("/api/admin/snapshot")
+async def create_snapshot():
+    """立即寫出快照（在 threadpool 中執行，不阻塞其他請求）"""
+    if not SNAPSHOT_PATH:
+        raise HTTPException(status_code=400, detail="未設定 ECHOFOCUS_SNAPSHOT_PATH")
+    saved = await write_snapshot()
+    return {"success": True, "saved_activities": saved}
+
 @app.get("/health")
 async def health_check():
     """健康檢查"""
     return {
         "status": "healthy",
         "total_activities": len(activities_db),
-        "total_users": len(users_db)
+        "total_users": len(users_db),
+        "rate_limit": limiter.stats(),
+        "snapshot": snapshot_status,
+        "startup": {"fast_startup": FAST_STARTUP, **startup_timings}
     }
 
+startup_timings["import_ms"] = round((time.perf_counter() - _IMPORT_STARTED) * 1000, 1)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
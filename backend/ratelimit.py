@@ -0,0 +1,295 @@
+"""
+限流模組 - 以 token bucket 限制批次寫入的頻率與每日配額
+
+每個 IP / 用戶只佔一個固定大小的 bucket，依最近使用順序存放在 OrderedDict，
+閒置過久的 key 從最舊的一端逐出，所以記憶體只與活躍 key 數量成正比。
+"""
+
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, fields, replace
+from typing import Dict, Optional, Tuple
+
+# 中介層解析過的 body 在 request.state 中的名稱
+PARSED_BODY = "parsed_body"
+
+
+def _finite_float(text: str) -> float:
+    value = float(text)
+    if value in (float("inf"), float("-inf")):
+        raise ValueError(f"數字超出範圍: {text}")
+    return value
+
+
+def _reject_constant(name: str):
+    raise ValueError(f"不支援的 JSON 常數: {name}")
+
+
+def parse_json(body):
+    """解析 JSON；NaN、Infinity 與超出 float 範圍的數字視為格式錯誤，回應中才不會出現無法序列化的值"""
+    return json.loads(body, parse_float=_finite_float, parse_constant=_reject_constant)
+
+
+@dataclass(frozen=True)
+class RateLimitConfig:
+    ip_rate: float = 5.0  # 每個 IP 每秒補充的請求數
+    ip_burst: int = 20
+    user_rate: float = 1.0  # 每個用戶每秒補充的批次數
+    user_burst: int = 10
+    max_batch_size: int = 500  # 單一批次最多幾筆活動
+    max_daily_activities: int = 50000  # 每個用戶每天（UTC）最多幾筆活動
+    max_body_bytes: int = 2 * 1024 * 1024
+    idle_seconds: float = 600.0  # bucket 閒置多久後逐出
+
+
+class TokenBucketTable:
+    """以 key 區分的 token bucket 集合，每個 key 只存 [tokens, 上次更新時間]"""
+
+    def __init__(self):
+        self._buckets: "OrderedDict[str, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, key, rate: float, burst: int, now: float, idle: float) -> Tuple[bool, float]:
+        """
+        嘗試取得一個 token
+
+        Returns:
+            (是否允許, 被拒絕時建議等待的秒數)
+        """
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [float(burst), now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+            self._buckets.move_to_end(key)
+
+        self._evict(now, idle)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return True, 0.0
+        return False, (1 - bucket[0]) / rate if rate > 0 else idle
+
+    def _evict(self, now: float, idle: float) -> None:
+        buckets = self._buckets
+        while buckets:
+            key, (_, last) = next(iter(buckets.items()))
+            if now - last <= idle:
+                break
+            del buckets[key]
+
+
+class DailyQuota:
+    """每個用戶當天已寫入的活動數；跨日的紀錄會被逐出"""
+
+    def __init__(self):
+        self._counts: "OrderedDict[int, list]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def consume(self, user_id: int, amount: int, limit: int, day: int) -> bool:
+        counts = self._counts
+        while counts:
+            key, (entry_day, _) = next(iter(counts.items()))
+            if entry_day == day:
+                break
+            del counts[key]
+
+        entry = counts.get(user_id)
+        if entry is None:
+            entry = counts[user_id] = [day, 0]
+        else:
+            counts.move_to_end(user_id)
+
+        if entry[1] + amount > limit:
+            return False
+        entry[1] += amount
+        return True
+
+    def refund(self, user_id: int, amount: int, day: int) -> None:
+        """退回請求失敗時先扣掉的配額"""
+        entry = self._counts.get(user_id)
+        if entry is not None and entry[0] == day:
+            entry[1] = max(0, entry[1] - amount)
+
+
+class RateLimiter:
+    """集中保存限流狀態、設定與拒絕次數統計"""
+
+    RELOAD_INTERVAL = 1.0
+
+    def __init__(self, config: Optional[RateLimitConfig] = None, config_path: Optional[str] = None):
+        self.config = config or RateLimitConfig()
+        self.config_path = config_path
+        self.ip_buckets = TokenBucketTable()
+        self.user_buckets = TokenBucketTable()
+        self.daily = DailyQuota()
+        self.metrics: Dict[str, int] = {
+            "rejected_ip": 0,
+            "rejected_user": 0,
+            "rejected_batch_size": 0,
+            "rejected_daily_quota": 0,
+        }
+        self._config_mtime = None
+        self._next_reload_check = 0.0
+
+    def update(self, **changes) -> RateLimitConfig:
+        """在執行中調整限流參數，不需重啟"""
+        self.config = replace(self.config, **changes)
+        return self.config
+
+    def reload_if_changed(self, now: float) -> None:
+        """最多每秒檢查一次設定檔，檔案有變動就重新載入"""
+        if not self.config_path or now < self._next_reload_check:
+            return
+        self._next_reload_check = now + self.RELOAD_INTERVAL
+        try:
+            mtime = os.stat(self.config_path).st_mtime
+            if mtime == self._config_mtime:
+                return
+            with open(self.config_path, encoding="utf-8") as f:
+                data = json.load(f)
+            known = {field.name for field in fields(RateLimitConfig)}
+            self.update(**{
+                k: type(getattr(self.config, k))(v) for k, v in data.items() if k in known
+            })
+            self._config_mtime = mtime
+        except (OSError, ValueError, TypeError) as e:
+            print(f"⚠️ 限流設定載入失敗，沿用目前設定: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            **self.metrics,
+            "active_ips": len(self.ip_buckets),
+            "active_users": len(self.user_buckets),
+            "config": asdict(self.config),
+        }
+
+
+class RateLimitMiddleware:
+    """
+    ASGI 中介層：只檢查批次寫入路徑，其他請求直接放行
+
+    依序檢查 IP 頻率、body 大小、批次筆數、用戶頻率與每日配額。
+    body 無法解析、或 user_id 不是整數時不檢查用戶限制，直接交給後面的路由回傳 422。
+    解析結果以 PARSED_BODY 放在 scope["state"]（即 request.state），路由不必重複解析。
+    每日配額先扣除，若後面的路由回傳錯誤（例如驗證失敗的 422）則退回。
+    """
+
+    def __init__(self, app, limiter: RateLimiter, paths=("/api/activity/batch",)):
+        self.app = app
+        self.limiter = limiter
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter
+        now = time.monotonic()
+        limiter.reload_if_changed(now)
+        config = limiter.config
+
+        client = scope.get("client")
+        ip = client[0] if client else "unknown"
+        allowed, retry_after = limiter.ip_buckets.allow(
+            ip, config.ip_rate, config.ip_burst, now, config.idle_seconds
+        )
+        if not allowed:
+            limiter.metrics["rejected_ip"] += 1
+            await _reject(send, 429, "請求過於頻繁", retry_after)
+            return
+
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            body.extend(message.get("body", b""))
+            more_body = message.get("more_body", False)
+            if len(body) > config.max_body_bytes:
+                limiter.metrics["rejected_batch_size"] += 1
+                await _reject(send, 413, "請求內容過大")
+                return
+
+        # body 只在這裡解析一次，結果放在 scope["state"] 交給路由，路由不再重複解析
+        try:
+            payload = parse_json(body)
+        except Exception:  # 含 RecursionError（過深的巢狀結構）等任何解析失敗
+            payload = None
+        else:
+            scope = dict(scope, state={**scope.get("state", {}), PARSED_BODY: payload})
+
+        user_id = count = None
+        if isinstance(payload, dict):
+            if type(payload.get("user_id")) is int:
+                user_id = payload["user_id"]
+            if isinstance(payload.get("activities"), list):
+                count = len(payload["activities"])
+
+        if count is not None and count > config.max_batch_size:
+            limiter.metrics["rejected_batch_size"] += 1
+            await _reject(send, 413, f"單一批次最多 {config.max_batch_size} 筆活動")
+            return
+
+        charged_day = None
+        if user_id is not None and count is not None:
+            allowed, retry_after = limiter.user_buckets.allow(
+                user_id, config.user_rate, config.user_burst, now, config.idle_seconds
+            )
+            if not allowed:
+                limiter.metrics["rejected_user"] += 1
+                await _reject(send, 429, "請求過於頻繁", retry_after)
+                return
+
+            day = int(time.time() // 86400)
+            if not limiter.daily.consume(user_id, count, config.max_daily_activities, day):
+                limiter.metrics["rejected_daily_quota"] += 1
+                await _reject(send, 429, "已達今日活動上限", 86400 - time.time() % 86400)
+                return
+            charged_day = day
+
+        body = bytes(body)
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if replayed:
+                return await receive()
+            replayed = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        status = None
+
+        async def send_and_record(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, replay, send_and_record)
+        finally:
+            if charged_day is not None and (status is None or status >= 400):
+                limiter.daily.refund(user_id, count, charged_day)
+
+
+async def _reject(send, status: int, detail: str, retry_after: Optional[float] = None):
+    """直接在 ASGI 層回傳錯誤，格式與 HTTPException 相同"""
+    content = json.dumps({"detail": detail}, ensure_ascii=False).encode("utf-8")
+    headers = [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(content)).encode()),
+    ]
+    if retry_after is not None:
+        headers.append((b"retry-after", str(max(1, int(retry_after + 0.999))).encode()))
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": content})
@@ -0,0 +1,499 @@
+"""
+快照模組 - 將記憶體中的活動資料存成精簡的二進位欄式檔案，並以 mmap 延遲載入
+
+檔案格式（little-endian，各區段 8 bytes 對齊）：
+
+    header   magic | version | 區塊大小 | 活動數 | 字串數 | 用戶數 | 統計數 | 統計項目數 | 區段表 | header CRC32
+    user_id  int64[活動數]，同一用戶的活動連續存放
+    duration int64[活動數]
+    timestamp / url / domain / category  uint32[活動數]，指向字串表的索引
+    str_offs uint64[字串數 + 1]，字串表中每個字串的起訖位置
+    str_data UTF-8 字串資料
+    agg      int64[用戶數 * 6]：user_id, 起始列, 筆數, 總秒數, 生產力秒數, 分心秒數
+    trk      int64[統計數 * 7]：熱門網域統計，user_id, 日期序數（0 為總計）, capacity,
+             總秒數, 是否精確, 起始項目, 項目數；依 user_id 排序
+    trk_ent  int64[統計項目數 * 4]：網域字串索引, 分類字串索引（-1 為無）, 計數, 誤差
+    crc      uint32[]：各區段依序切成固定大小的區塊，每個區塊一個 CRC32
+
+區段表每項為 (位置, 長度, 該區段第一個區塊在 crc 區段中的索引)；crc 區段本身的第三欄
+是整個 crc 區段的 CRC32。載入時只檢查 header 與 crc 區段（每 MiB 資料 4 bytes），
+資料頁在第一次存取時才由作業系統載入；每個區塊在第一次被讀取前一定會先檢查 CRC32，
+也可呼叫 Snapshot.verify() 一次檢查全部。
+"""
+
+import bisect
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+import threading
+import zlib
+from array import array
+from collections.abc import Sequence
+from datetime import date
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+MAGIC = b"EFSNAP\x00\x01"
+VERSION = 4
+BLOCK_SIZE = 1024 * 1024
+
+SECTIONS = [
+    ("user_id", "q"),
+    ("duration", "q"),
+    ("timestamp", "I"),
+    ("url", "I"),
+    ("domain", "I"),
+    ("category", "I"),
+    ("str_offs", "Q"),
+    ("str_data", "B"),
+    ("agg", "q"),
+    ("trk", "q"),
+    ("trk_ent", "q"),
+    ("crc", "I"),
+]
+STRING_FIELDS = ["timestamp", "url", "domain", "category"]
+AGG_WIDTH = 6
+TRK_WIDTH = 7
+TRK_ENT_WIDTH = 4
+ROW_COLUMNS = ["user_id", "duration"] + STRING_FIELDS
+
+_HEAD = struct.Struct("<8sIIQQQQQ")
+_SECTION = struct.Struct("<QQI")
+HEADER_SIZE = _HEAD.size + _SECTION.size * len(SECTIONS) + 4
+
+_save_lock = threading.Lock()
+
+
+class SnapshotError(ValueError):
+    """快照檔損毀或格式不符"""
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def save(path: str, activities: Iterable[Dict], trackers: Iterable[Tuple] = ()) -> int:
+    """
+    將活動寫入快照檔（先寫唯一的暫存檔再 rename，確保不會留下半個檔案）
+
+    同時有多個寫出時依序進行，後完成的一份會成為最新的快照。
+
+    Args:
+        path: 快照檔路徑
+        activities: 活動列表，每筆需含 user_id, url, domain, duration, timestamp, category
+        trackers: 熱門網域統計，每筆為 (user_id, 日期或 None, capacity, total, exact,
+            [(網域, 計數, 誤差, 分類), ...])，需依 user_id 排序（topk.DomainTrackers.export()）
+
+    Returns:
+        寫入的活動筆數
+    """
+    codes = dict(SECTIONS)
+    groups: Dict[int, Dict[str, array]] = {}
+    strings: Dict[str, int] = {}
+    str_offs = array("Q", [0])
+    str_data = bytearray()
+    aggregates: Dict[int, List[int]] = {}
+
+    def intern(value: str) -> int:
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(strings)
+            str_data.extend(value.encode("utf-8"))
+            str_offs.append(len(str_data))
+        return index
+
+    for activity in activities:
+        user_id = activity["user_id"]
+        duration = activity["duration"]
+        group = groups.get(user_id)
+        if group is None:
+            group = groups[user_id] = {name: array(codes[name]) for name in ROW_COLUMNS}
+            aggregates[user_id] = [user_id, 0, 0, 0, 0, 0]
+        group["user_id"].append(user_id)
+        group["duration"].append(duration)
+        for field in STRING_FIELDS:
+            group[field].append(intern(activity[field]))
+
+        agg = aggregates[user_id]
+        agg[2] += 1
+        agg[3] += duration
+        if activity["category"] == "productive":
+            agg[4] += duration
+        elif activity["category"] == "distraction":
+            agg[5] += duration
+
+    # 依用戶分組寫出，讓每位用戶的活動成為連續的一段
+    columns = {name: array(code) for name, code in SECTIONS}
+    for user_id in sorted(groups):
+        aggregates[user_id][1] = len(columns["user_id"])
+        group = groups.pop(user_id)
+        for name in ROW_COLUMNS:
+            columns[name].extend(group[name])
+        columns["agg"].extend(aggregates[user_id])
+
+    trk = columns["trk"]
+    trk_ent = columns["trk_ent"]
+    for user_id, day, capacity, total, exact, entries in trackers:
+        trk.extend((
+            user_id, day.toordinal() if day is not None else 0, capacity,
+            total, int(exact), len(trk_ent) // TRK_ENT_WIDTH, len(entries),
+        ))
+        for domain, count, error, label in entries:
+            trk_ent.extend((
+                intern(domain), intern(label) if label is not None else -1, count, error,
+            ))
+
+    columns["str_offs"] = str_offs
+    columns["str_data"] = array("B", str_data)
+
+    if sys.byteorder != "little":
+        for column in columns.values():
+            column.byteswap()
+
+    block_size = BLOCK_SIZE
+    payloads = [columns[name].tobytes() for name, _ in SECTIONS[:-1]]
+    crcs = array("I")
+    table = []
+    offset = _align(HEADER_SIZE)
+    for payload in payloads:
+        table.append((offset, len(payload), len(crcs)))
+        view = memoryview(payload)
+        for start in range(0, len(payload), block_size):
+            crcs.append(zlib.crc32(view[start:start + block_size]))
+        offset = _align(offset + len(payload))
+    if sys.byteorder != "little":
+        crcs.byteswap()
+    payloads.append(crcs.tobytes())
+    table.append((offset, len(payloads[-1]), zlib.crc32(payloads[-1])))
+
+    header = _HEAD.pack(
+        MAGIC, VERSION, block_size, len(columns["user_id"]), len(strings), len(aggregates),
+        len(columns["trk"]) // TRK_WIDTH, len(columns["trk_ent"]) // TRK_ENT_WIDTH,
+    ) + b"".join(_SECTION.pack(*entry) for entry in table)
+    header += struct.pack("<I", zlib.crc32(header))
+
+    directory, name = os.path.split(os.path.abspath(path))
+    with _save_lock:
+        fd, tmp_path = tempfile.mkstemp(prefix=f".{name}.", suffix=".tmp", dir=directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(header)
+                for (offset, _, _), payload in zip(table, payloads):
+                    f.write(b"\0" * (offset - f.tell()))
+                    f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    return len(columns["user_id"])
+
+
+class Snapshot(Sequence):
+    """以 mmap 開啟的唯讀快照，每筆活動在存取時才組成 dict"""
+
+    def __init__(self, path: str):
+        if sys.byteorder != "little":
+            raise SnapshotError("快照僅支援 little-endian 平台")
+
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size < HEADER_SIZE:
+                raise SnapshotError("快照檔過小")
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        header = self._mmap[:HEADER_SIZE]
+        (expected_crc,) = struct.unpack_from("<I", header, HEADER_SIZE - 4)
+        if zlib.crc32(header[:-4]) != expected_crc:
+            raise SnapshotError("快照 header 校驗失敗")
+
+        (magic, version, self._block_size, self._count, self._string_count, self._user_count,
+         self._tracker_count, self._tracker_entry_count) = _HEAD.unpack_from(header)
+        if magic != MAGIC or version != VERSION or self._block_size < 1:
+            raise SnapshotError("不支援的快照格式")
+
+        view = memoryview(self._mmap)
+        self._raw = {}
+        self._sections = {}
+        self._first_block = {}
+        for i, (name, code) in enumerate(SECTIONS):
+            offset, length, extra = _SECTION.unpack_from(
+                header, _HEAD.size + i * _SECTION.size
+            )
+            if offset + length > size or length % array(code).itemsize:
+                raise SnapshotError(f"快照區段 {name} 超出檔案範圍")
+            self._raw[name] = view[offset:offset + length]
+            self._sections[name] = self._raw[name].cast(code)
+            self._first_block[name] = extra
+
+        # crc 區段很小，載入時就整段檢查，之後各區塊只需比對自己的 CRC32
+        if zlib.crc32(self._raw["crc"]) != self._first_block.pop("crc"):
+            raise SnapshotError("快照區段 crc 校驗失敗")
+        self._crcs = self._sections["crc"]
+        self._checked = {}
+        blocks = 0
+        for name, _ in SECTIONS[:-1]:
+            if self._first_block[name] != blocks:
+                raise SnapshotError(f"快照區段 {name} 的區塊索引不符")
+            count = -(-len(self._raw[name]) // self._block_size)
+            self._checked[name] = bytearray(count)
+            blocks += count
+        if blocks != len(self._crcs):
+            raise SnapshotError("快照區段 crc 長度不符")
+        self._unchecked = blocks
+        self._check_lock = threading.Lock()
+
+        expected = {
+            "str_offs": self._string_count + 1,
+            "agg": self._user_count * AGG_WIDTH,
+            "trk": self._tracker_count * TRK_WIDTH,
+            "trk_ent": self._tracker_entry_count * TRK_ENT_WIDTH,
+        }
+        for name, _ in SECTIONS[:-1]:
+            if name == "str_data":
+                continue
+            if len(self._sections[name]) != expected.get(name, self._count):
+                raise SnapshotError(f"快照區段 {name} 長度不符")
+
+    def verify(self) -> None:
+        """檢查所有尚未檢查過的區塊的 CRC32（會讀取整個檔案）"""
+        for name, _ in SECTIONS[:-1]:
+            self._section(name)
+
+    @property
+    def verified(self) -> bool:
+        return not self._unchecked
+
+    def _check(self, name: str, start: int, stop: int) -> None:
+        """確認區段中 [start, stop) bytes 所在的區塊都已通過 CRC32 檢查，損毀時拋出 SnapshotError"""
+        size = self._block_size
+        checked = self._checked[name]
+        for block in range(start // size, (stop - 1) // size + 1):
+            if checked[block]:
+                continue
+            data = self._raw[name][block * size:(block + 1) * size]
+            if zlib.crc32(data) != self._crcs[self._first_block[name] + block]:
+                raise SnapshotError(f"快照區段 {name} 第 {block} 個區塊校驗失敗")
+            with self._check_lock:
+                if not checked[block]:
+                    checked[block] = 1
+                    self._unchecked -= 1
+
+    def _column(self, name: str, first: int, stop: Optional[int] = None) -> memoryview:
+        """取得區段，並確認第 first 到 stop（不含，預設只有 first）個元素所在的區塊都已檢查"""
+        section = self._sections[name]
+        if self._unchecked:
+            itemsize = section.itemsize
+            stop = first + 1 if stop is None else stop
+            if stop > first:
+                self._check(name, first * itemsize, stop * itemsize)
+        return section
+
+    def _section(self, name: str) -> memoryview:
+        """取得整個區段，所有區塊都先檢查過"""
+        return self._column(name, 0, len(self._sections[name]))
+
+    def _string(self, index: int) -> str:
+        offs = self._column("str_offs", index, index + 2)
+        start, stop = offs[index], offs[index + 1]
+        return self._column("str_data", start, stop)[start:stop].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self._count))]
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("snapshot index out of range")
+
+        column = self._column
+        return {
+            "url": self._string(column("url", index)[index]),
+            "domain": self._string(column("domain", index)[index]),
+            "duration": column("duration", index)[index],
+            "timestamp": self._string(column("timestamp", index)[index]),
+            "category": self._string(column("category", index)[index]),
+            "user_id": column("user_id", index)[index],
+        }
+
+    def timestamp(self, index: int) -> str:
+        """只解碼某一列的時間字串，不組出整筆 dict"""
+        return self._string(self._column("timestamp", index)[index])
+
+    def _find_rows(self, name: str, width: int, user_id: int) -> range:
+        """在依 user_id 排序、每列 width 個欄位的區段中二分搜尋某用戶的列範圍，只讀取經過的區塊"""
+        def key(row):
+            return self._column(name, row * width)[row * width]
+
+        rows = range(len(self._sections[name]) // width)
+        first = bisect.bisect_left(rows, user_id, key=key)
+        return range(first, bisect.bisect_right(rows, user_id, lo=first, key=key))
+
+    def user_aggregate(self, user_id: int) -> Optional[Dict]:
+        """快照當下某用戶的列範圍與統計；快照中沒有此用戶時為 None"""
+        rows = self._find_rows("agg", AGG_WIDTH, user_id)
+        if not rows:
+            return None
+        i = rows.start * AGG_WIDTH
+        agg = self._column("agg", i, i + AGG_WIDTH)
+        return {
+            "start": agg[i + 1],
+            "count": agg[i + 2],
+            "total_seconds": agg[i + 3],
+            "productive_seconds": agg[i + 4],
+            "distraction_seconds": agg[i + 5],
+        }
+
+    def user_rows(self, user_id: int) -> range:
+        """某用戶在快照中的列索引"""
+        entry = self.user_aggregate(user_id)
+        if entry is None:
+            return range(0)
+        return range(entry["start"], entry["start"] + entry["count"])
+
+    def tracker_users(self) -> List[int]:
+        """有保存熱門網域統計的用戶（會讀取整個 trk 區段）"""
+        trk = self._section("trk")
+        return list(dict.fromkeys(trk[::TRK_WIDTH]))
+
+    def domain_trackers(self, user_id: int) -> List[Tuple]:
+        """某用戶保存的熱門網域統計：[(日期或 None, capacity, total, exact, entries), ...]"""
+        result = []
+        for row in self._find_rows("trk", TRK_WIDTH, user_id):
+            i = row * TRK_WIDTH
+            _, ordinal, capacity, total, exact, first, count = \
+                self._column("trk", i, i + TRK_WIDTH)[i:i + TRK_WIDTH]
+            trk_ent = self._column("trk_ent", first * TRK_ENT_WIDTH, (first + count) * TRK_ENT_WIDTH)
+            entries = []
+            for e in range(first, first + count):
+                domain, label, value, error = trk_ent[e * TRK_ENT_WIDTH:(e + 1) * TRK_ENT_WIDTH]
+                entries.append((
+                    self._string(domain), value, error,
+                    self._string(label) if label >= 0 else None,
+                ))
+            day = date.fromordinal(ordinal) if ordinal else None
+            result.append((day, capacity, total, bool(exact), entries))
+        return result
+
+
+def _empty_totals() -> Dict[str, int]:
+    return {"count": 0, "total_seconds": 0, "productive_seconds": 0, "distraction_seconds": 0}
+
+
+class ActivityLog(Sequence):
+    """
+    唯讀快照加上之後新寫入的活動，對外的行為與 list 相同
+
+    另外維護每位用戶的列索引與累計統計，查詢單一用戶時不必解碼其他用戶的資料。
+    """
+
+    def __init__(self, base: Optional[Snapshot] = None):
+        self.base = base
+        self._base_len = len(base) if base is not None else 0
+        self._tail: List[Dict] = []
+        self._tail_rows: Dict[int, List[int]] = {}
+        self._tail_totals: Dict[int, Dict[str, int]] = {}
+
+    def append(self, activity: Dict) -> None:
+        user_id = activity["user_id"]
+        self._tail_rows.setdefault(user_id, []).append(len(self._tail))
+        self._tail.append(activity)
+
+        totals = self._tail_totals.get(user_id)
+        if totals is None:
+            totals = self._tail_totals[user_id] = _empty_totals()
+        totals["count"] += 1
+        totals["total_seconds"] += activity["duration"]
+        if activity["category"] == "productive":
+            totals["productive_seconds"] += activity["duration"]
+        elif activity["category"] == "distraction":
+            totals["distraction_seconds"] += activity["duration"]
+
+    def __len__(self) -> int:
+        return self._base_len + len(self._tail)
+
+    def detach_base(self) -> None:
+        """快照損毀時捨棄快照部分，只保留之後寫入的活動"""
+        self.base = None
+        self._base_len = 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < self._base_len:
+            if index < 0:
+                raise IndexError("activity index out of range")
+            return self.base[index]
+        return self._tail[index - self._base_len]
+
+    def __iter__(self) -> Iterator[Dict]:
+        if self.base is not None:
+            yield from self.base
+        yield from self._tail
+
+    def user_totals(self, user_id: int) -> Dict[str, int]:
+        """某用戶的筆數與各類別秒數，不需走訪活動"""
+        totals = _empty_totals()
+        sources = [self._tail_totals.get(user_id)]
+        if self.base is not None:
+            sources.append(self.base.user_aggregate(user_id))
+        for source in sources:
+            if source:
+                for key in totals:
+                    totals[key] += source[key]
+        return totals
+
+    def iter_user(self, user_id: int, keep: Optional[Callable[[str], bool]] = None) -> Iterator[Dict]:
+        """
+        依寫入順序走訪某用戶的活動
+
+        Args:
+            user_id: 用戶 ID
+            keep: 以時間字串判斷是否保留的函式；快照中的列只在保留時才組成 dict
+        """
+        base = self.base
+        if base is not None:
+            for i in base.user_rows(user_id):
+                if keep is None or keep(base.timestamp(i)):
+                    yield base[i]
+        tail = self._tail
+        for j in self._tail_rows.get(user_id, ()):
+            activity = tail[j]
+            if keep is None or keep(activity["timestamp"]):
+                yield activity
+
+    def latest(self, user_id: int, n: int) -> List[Dict]:
+        """某用戶時間最新的 n 筆活動，由新到舊排序"""
+        candidates = []
+        base = self.base
+        if base is not None:
+            rows = heapq.nlargest(n, base.user_rows(user_id), key=base.timestamp)
+            candidates.extend(base[i] for i in rows)
+        tail = self._tail
+        candidates.extend(tail[j] for j in self._tail_rows.get(user_id, ()))
+        return heapq.nlargest(n, candidates, key=lambda a: a["timestamp"])
+
+
+def load(path: str, verify: bool = False) -> ActivityLog:
+    """
+    以 mmap 載入快照
+
+    Args:
+        path: 快照檔路徑
+        verify: 是否立即檢查所有區塊的 CRC32（會讀取整個檔案）
+
+    Returns:
+        可繼續 append 的 ActivityLog
+    """
+    base = Snapshot(path)
+    if verify:
+        base.verify()
+    return ActivityLog(base)
@@ -0,0 +1,103 @@
+"""
+exporter 模組測試 - 分塊輸出、gzip 串流與時間區間過濾
+"""
+
+import csv
+import gzip
+import io
+import json
+from datetime import datetime, timedelta, timezone
+
+import exporter
+import snapshot
+
+
+def make_log(timestamps, user_id=1):
+    log = snapshot.ActivityLog()
+    for i, ts in enumerate(timestamps):
+        log.append({
+            "user_id": user_id,
+            "url": f"https://example.com/{i}",
+            "domain": "example.com",
+            "duration": i,
+            "timestamp": ts,
+            "category": "productive",
+        })
+    return log
+
+
+def test_only_exports_requested_user():
+    log = make_log(["2024-02-03T10:00:00"])
+    log.append(dict(log[0], user_id=2, url="https://other.com/"))
+
+    rows = list(exporter.iter_user_activities(log, 2))
+    assert [a["url"] for a in rows] == ["https://other.com/"]
+
+
+def test_range_is_half_open():
+    log = make_log([
+        "2024-02-03T09:59:59",
+        "2024-02-03T10:00:00",
+        "2024-02-03T10:59:59",
+        "2024-02-03T11:00:00",
+    ])
+    rows = exporter.iter_user_activities(
+        log, 1, datetime(2024, 2, 3, 10), datetime(2024, 2, 3, 11)
+    )
+    assert [a["timestamp"] for a in rows] == ["2024-02-03T10:00:00", "2024-02-03T10:59:59"]
+
+
+def test_tz_aware_bounds_and_timestamps_compare_in_utc():
+    log = make_log(["2024-02-03T10:30:00Z", "2024-02-03T12:30:00+02:00", "2024-02-03T12:00:00"])
+    taipei = timezone(timedelta(hours=8))
+    # 18:00+08:00 == 10:00 UTC，19:00+08:00 == 11:00 UTC
+    rows = exporter.iter_user_activities(
+        log, 1, datetime(2024, 2, 3, 18, tzinfo=taipei), datetime(2024, 2, 3, 19, tzinfo=taipei)
+    )
+    assert [a["timestamp"] for a in rows] == ["2024-02-03T10:30:00Z", "2024-02-03T12:30:00+02:00"]
+
+
+def test_malformed_timestamps_are_skipped_when_filtering():
+    log = make_log(["2024-02-03T10:00:00", "not-a-time", "2024-02-04T10:00:00"])
+    rows = exporter.iter_user_activities(log, 1, start=datetime(2024, 2, 1))
+    assert [a["timestamp"] for a in rows] == ["2024-02-03T10:00:00", "2024-02-04T10:00:00"]
+    # 不指定區間時不解析時間，全部匯出
+    assert len(list(exporter.iter_user_activities(log, 1))) == 3
+
+
+def test_csv_chunks_and_quoting(monkeypatch):
+    monkeypatch.setattr(exporter, "CHUNK_SIZE", 256)
+    log = make_log([f"2024-02-03T10:{i % 60:02d}:00" for i in range(100)])
+    log.append(dict(log[0], url='https://example.com/a,"b"'))
+
+    chunks = list(exporter.iter_csv(exporter.iter_user_activities(log, 1)))
+    assert len(chunks) > 1
+    assert all(len(chunk) < 512 for chunk in chunks)
+
+    rows = list(csv.reader(io.StringIO(b"".join(chunks).decode("utf-8"))))
+    assert rows[0] == exporter.EXPORT_FIELDS
+    assert len(rows) == 102
+    assert rows[-1][2] == 'https://example.com/a,"b"'
+
+
+def test_ndjson_lines_round_trip(monkeypatch):
+    monkeypatch.setattr(exporter, "CHUNK_SIZE", 256)
+    log = make_log([f"2024-02-03T10:{i:02d}:00" for i in range(30)])
+    log.append(dict(log[0], domain="網域.tw"))
+
+    chunks = list(exporter.iter_ndjson(exporter.iter_user_activities(log, 1)))
+    assert len(chunks) > 1
+    lines = b"".join(chunks).decode("utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == [
+        {field: a[field] for field in exporter.EXPORT_FIELDS} for a in log
+    ]
+
+
+def test_gzip_stream_round_trip():
+    payload = [f"line {i}\n".encode() * 50 for i in range(200)]
+    compressed = b"".join(exporter.gzip_stream(iter(payload)))
+    assert gzip.decompress(compressed) == b"".join(payload)
+
+
+def test_gzip_stream_of_empty_input_is_valid():
+    assert gzip.decompress(b"".join(exporter.gzip_stream(iter([])))) == b""
@@ -0,0 +1,161 @@
+"""
+ratelimit 模組測試 - 配額退回、跨日、閒置逐出、設定重新載入與格式錯誤的 body
+"""
+
+import asyncio
+import json
+import os
+
+import pytest
+
+import ratelimit
+
+
+def make_app(status=200):
+    """回傳固定狀態碼的 ASGI app，並記下收到的 body 與中介層解析的結果"""
+    seen = []
+
+    async def app(scope, receive, send):
+        message = await receive()
+        seen.append((message["body"], scope.get("state", {}).get(ratelimit.PARSED_BODY)))
+        if status is None:
+            raise RuntimeError("route failed")
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    app.seen = seen
+    return app
+
+
+def post(middleware, body, ip="1.2.3.4"):
+    """送出一個批次寫入請求，回傳狀態碼"""
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    scope = {"type": "http", "method": "POST", "path": "/api/activity/batch", "client": (ip, 0)}
+    responses = []
+
+    async def receive():
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            responses.append(message["status"])
+
+    async def run():
+        try:
+            await middleware(scope, receive, send)
+        except RuntimeError:
+            responses.append(None)
+
+    asyncio.run(run())
+    return responses[0]
+
+
+def batch(user_id, n):
+    return {"user_id": user_id, "activities": [{"url": "u"}] * n}
+
+
+@pytest.fixture
+def limiter():
+    return ratelimit.RateLimiter(ratelimit.RateLimitConfig(
+        ip_burst=1000, user_burst=1000, max_batch_size=10, max_daily_activities=5,
+    ))
+
+
+def test_quota_is_refunded_when_route_fails(limiter):
+    for status in (422, 500, None):
+        middleware = ratelimit.RateLimitMiddleware(make_app(status), limiter)
+        assert post(middleware, batch(1, 5)) == status
+
+    middleware = ratelimit.RateLimitMiddleware(make_app(200), limiter)
+    assert post(middleware, batch(1, 5)) == 200
+    assert post(middleware, batch(1, 1)) == 429
+    assert limiter.metrics["rejected_daily_quota"] == 1
+
+
+def test_daily_quota_resets_on_next_utc_day(limiter, monkeypatch):
+    middleware = ratelimit.RateLimitMiddleware(make_app(), limiter)
+    day = 20000 * 86400
+    monkeypatch.setattr(ratelimit.time, "time", lambda: day + 86399.0)
+    assert post(middleware, batch(1, 5)) == 200
+    assert post(middleware, batch(1, 1)) == 429
+
+    monkeypatch.setattr(ratelimit.time, "time", lambda: day + 86400.0)
+    assert post(middleware, batch(1, 5)) == 200
+    assert len(limiter.daily) == 1
+
+
+def test_batch_size_is_checked_before_user_limits(limiter):
+    middleware = ratelimit.RateLimitMiddleware(make_app(), limiter)
+    assert post(middleware, batch(1, 11)) == 413
+    assert len(limiter.user_buckets) == 0 and len(limiter.daily) == 0
+
+
+def test_parsed_body_is_handed_to_route(limiter):
+    app = make_app()
+    middleware = ratelimit.RateLimitMiddleware(app, limiter)
+    assert post(middleware, batch(7, 2)) == 200
+    body, parsed = app.seen[0]
+    assert json.loads(body) == parsed == batch(7, 2)
+
+
+@pytest.mark.parametrize("body", [
+    b'{"user_id": Infinity, "activities": []}',
+    b'{"user_id": 1e400, "activities": []}',
+    b'{"user_id": NaN, "activities": []}',
+    b'{"user_id": 1, "activities": ' + b"[" * 100000 + b"]" * 100000 + b"}",
+    b'{"user_id": 1.7, "activities": []}',
+    b'{"user_id": "1", "activities": []}',
+    b'{"user_id": true, "activities": []}',
+    b'{"user_id": 1, "activities": {}}',
+    b"[1, 2]",
+    b"not json",
+])
+def test_malformed_bodies_pass_through_without_charging(limiter, body):
+    app = make_app(422)
+    middleware = ratelimit.RateLimitMiddleware(app, limiter)
+    assert post(middleware, body) == 422
+    assert app.seen[0][0] == body
+    assert len(limiter.user_buckets) == 0 and len(limiter.daily) == 0
+
+
+def test_ip_burst_then_refill():
+    table = ratelimit.TokenBucketTable()
+    assert [table.allow("ip", 1.0, 2, 0.0, 600)[0] for _ in range(3)] == [True, True, False]
+    allowed, retry_after = table.allow("ip", 1.0, 2, 0.5, 600)
+    assert not allowed and retry_after == pytest.approx(0.5)
+    assert table.allow("ip", 1.0, 2, 1.5, 600)[0]
+
+
+def test_idle_buckets_are_evicted():
+    table = ratelimit.TokenBucketTable()
+    for i in range(100):
+        table.allow(f"ip{i}", 1.0, 5, float(i), idle=10)
+    # 最後一次呼叫時 now = 99，閒置超過 10 秒的 ip0 ~ ip88 都已逐出
+    assert len(table) == 11
+    table.allow("ip99", 1.0, 5, 200.0, idle=10)
+    assert len(table) == 1
+
+
+def test_config_file_is_reloaded_when_changed(tmp_path, capsys):
+    path = tmp_path / "ratelimit.json"
+    path.write_text(json.dumps({"user_rate": 2, "max_batch_size": "100", "unknown": 1}))
+    limiter = ratelimit.RateLimiter(config_path=str(path))
+
+    limiter.reload_if_changed(0.0)
+    assert limiter.config.user_rate == 2.0 and limiter.config.max_batch_size == 100
+
+    path.write_text(json.dumps({"max_batch_size": 7}))
+    os.utime(path, (1, 1))
+    # 一秒內不重新檢查
+    limiter.reload_if_changed(0.5)
+    assert limiter.config.max_batch_size == 100
+    limiter.reload_if_changed(1.0)
+    assert limiter.config.max_batch_size == 7 and limiter.config.user_rate == 2.0
+
+    # 格式錯誤時沿用目前設定
+    path.write_text("{broken")
+    os.utime(path, (2, 2))
+    limiter.reload_if_changed(2.0)
+    assert limiter.config.max_batch_size == 7
+    assert "限流設定載入失敗" in capsys.readouterr().out
@@ -0,0 +1,168 @@
+"""
+snapshot 模組測試 - 二進位格式的往返、截斷與 CRC32 檢查
+"""
+
+import os
+
+import pytest
+
+import snapshot
+
+
+def make_activities(n, users=3):
+    categories = ["productive", "distraction", "neutral"]
+    return [
+        {
+            "user_id": i % users + 1,
+            "url": f"https://example.com/{i % 17}",
+            "domain": f"site{i % 5}.com",
+            "duration": i * 7,
+            "timestamp": f"2024-02-{1 + i % 9:02d}T10:{i % 60:02d}:00",
+            "category": categories[i % 3],
+        }
+        for i in range(n)
+    ]
+
+
+@pytest.fixture
+def snapshot_path(tmp_path):
+    return str(tmp_path / "activities.snap")
+
+
+def test_round_trip_groups_rows_by_user(snapshot_path):
+    activities = make_activities(500)
+    assert snapshot.save(snapshot_path, activities) == 500
+
+    log = snapshot.load(snapshot_path, verify=True)
+    assert len(log) == 500
+    # 同一用戶的活動連續存放，且保留寫入順序
+    expected = [a for user_id in (1, 2, 3) for a in activities if a["user_id"] == user_id]
+    assert list(log) == expected
+
+
+def test_empty_snapshot(snapshot_path):
+    snapshot.save(snapshot_path, [])
+    log = snapshot.load(snapshot_path, verify=True)
+    assert len(log) == 0
+    assert log.user_totals(1)["count"] == 0
+
+
+def test_user_index_and_totals_include_appended_rows(snapshot_path):
+    activities = make_activities(300)
+    snapshot.save(snapshot_path, activities)
+    log = snapshot.load(snapshot_path)
+
+    extra = dict(activities[0], duration=99, timestamp="2024-03-01T00:00:00")
+    log.append(extra)
+    activities.append(extra)
+
+    for user_id in (1, 2, 3, 4):
+        mine = [a for a in activities if a["user_id"] == user_id]
+        totals = log.user_totals(user_id)
+        assert totals["count"] == len(mine)
+        assert totals["total_seconds"] == sum(a["duration"] for a in mine)
+        assert totals["productive_seconds"] == sum(
+            a["duration"] for a in mine if a["category"] == "productive"
+        )
+        assert list(log.iter_user(user_id)) == mine
+        latest = sorted(mine, key=lambda a: a["timestamp"], reverse=True)[:10]
+        assert [a["timestamp"] for a in log.latest(user_id, 10)] == [
+            a["timestamp"] for a in latest
+        ]
+
+
+def test_iter_user_filter_only_keeps_matching_rows(snapshot_path):
+    snapshot.save(snapshot_path, make_activities(90))
+    log = snapshot.load(snapshot_path)
+    rows = list(log.iter_user(1, keep=lambda ts: ts.startswith("2024-02-01")))
+    assert rows and all(a["timestamp"].startswith("2024-02-01") for a in rows)
+
+
+def test_truncated_file_is_rejected(snapshot_path):
+    snapshot.save(snapshot_path, make_activities(100))
+    with open(snapshot_path, "r+b") as f:
+        f.truncate(os.path.getsize(snapshot_path) - 16)
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.load(snapshot_path)
+
+    with open(snapshot_path, "r+b") as f:
+        f.truncate(10)
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.load(snapshot_path)
+
+
+def test_header_corruption_is_rejected(snapshot_path):
+    snapshot.save(snapshot_path, make_activities(100))
+    with open(snapshot_path, "r+b") as f:
+        f.seek(12)
+        byte = f.read(1)
+        f.seek(12)
+        f.write(bytes([byte[0] ^ 0xFF]))
+    with pytest.raises(snapshot.SnapshotError, match="header"):
+        snapshot.load(snapshot_path)
+
+
+def test_section_corruption_is_caught_before_first_read(snapshot_path):
+    snapshot.save(snapshot_path, make_activities(100))
+    data = bytearray(open(snapshot_path, "rb").read())
+    index = data.index(b"https://example.com/")
+    data[index] ^= 0xFF
+    with open(snapshot_path, "wb") as f:
+        f.write(data)
+
+    # 只檢查 header 與 crc 區段，所以載入成功；讀到損毀的區塊時一定會拋出 SnapshotError
+    log = snapshot.load(snapshot_path)
+    with pytest.raises(snapshot.SnapshotError, match="str_data"):
+        log[0]
+    with pytest.raises(snapshot.SnapshotError, match="str_data"):
+        log.base.verify()
+    with pytest.raises(snapshot.SnapshotError):
+        snapshot.load(snapshot_path, verify=True)
+
+
+def test_only_blocks_that_are_read_get_checked(snapshot_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "BLOCK_SIZE", 64)
+    snapshot.save(snapshot_path, make_activities(300))
+
+    # 第 250 列屬於最後一位用戶，損毀它的 duration 不影響其他用戶的區塊
+    with open(snapshot_path, "rb") as f:
+        header = f.read(snapshot.HEADER_SIZE)
+    names = [name for name, _ in snapshot.SECTIONS]
+    offset, _, _ = snapshot._SECTION.unpack_from(
+        header, snapshot._HEAD.size + names.index("duration") * snapshot._SECTION.size
+    )
+    with open(snapshot_path, "r+b") as f:
+        f.seek(offset + 250 * 8)
+        f.write(b"\xff")
+
+    log = snapshot.load(snapshot_path)
+    assert [a["user_id"] for a in log.iter_user(1)] == [1] * 100
+    assert log.user_totals(3)["count"] == 100
+    assert not log.base.verified
+    with pytest.raises(snapshot.SnapshotError, match="duration"):
+        list(log.iter_user(3))
+    with pytest.raises(snapshot.SnapshotError, match="duration"):
+        log.base.verify()
+
+
+def test_detach_base_keeps_appended_rows(snapshot_path):
+    activities = make_activities(50)
+    snapshot.save(snapshot_path, activities)
+    log = snapshot.load(snapshot_path)
+    log.append(activities[0])
+    log.detach_base()
+
+    assert len(log) == 1
+    assert list(log.iter_user(activities[0]["user_id"])) == [activities[0]]
+    assert log.user_totals(activities[0]["user_id"])["count"] == 1
+
+
+def test_save_replaces_file_without_leaving_temp_files(snapshot_path, tmp_path):
+    snapshot.save(snapshot_path, make_activities(10))
+    log = snapshot.load(snapshot_path)
+    # 舊的 mmap 在檔案被取代後仍可讀取
+    snapshot.save(snapshot_path, make_activities(20))
+
+    assert len(log) == 10 and log[0]["user_id"] == 1
+    assert len(snapshot.load(snapshot_path, verify=True)) == 20
+    assert os.listdir(tmp_path) == ["activities.snap"]
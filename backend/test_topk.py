@@ -0,0 +1,182 @@
+"""
+topk 模組測試 - Space-Saving 的誤差界限、合併、保留期限與快照保存
+"""
+
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+import pytest
+
+import snapshot
+import topk
+
+
+def skewed_stream(n, seed=1):
+    rng = random.Random(seed)
+    return [(f"site{int(rng.paretovariate(1.1))}.com", rng.randint(1, 600)) for _ in range(n)]
+
+
+def exact_counts(stream):
+    counts = Counter()
+    for domain, weight in stream:
+        counts[domain] += weight
+    return counts
+
+
+def assert_within_bounds(tracker, exact, epsilon):
+    total = sum(exact.values())
+    assert tracker.total == total
+    for domain, count in tracker.counts.items():
+        # 估計值是上限，扣掉誤差後是下限，且高估不超過 epsilon * 總量
+        assert count >= exact[domain]
+        assert count - tracker.error(domain) <= exact[domain]
+        assert count - exact[domain] <= epsilon * total
+    # 真正超過 epsilon * 總量的網域一定會被保留
+    for domain, count in exact.items():
+        if count > epsilon * total:
+            assert domain in tracker.counts
+
+
+def test_exact_for_small_inputs():
+    stream = [("a.com", 5), ("b.com", 9), ("a.com", 5), ("c.com", 1)]
+    tracker = topk.SpaceSaving(epsilon=0.1)
+    for domain, weight in stream:
+        tracker.update(domain, weight)
+
+    assert tracker.exact
+    assert tracker.top(2) == [("a.com", 10), ("b.com", 9)]
+    assert tracker.error("a.com") == 0
+
+
+def test_error_bounds_on_skewed_stream():
+    epsilon = 0.01
+    stream = skewed_stream(50000)
+    tracker = topk.SpaceSaving(epsilon)
+    for domain, weight in stream:
+        tracker.update(domain, weight)
+
+    exact = exact_counts(stream)
+    assert not tracker.exact
+    assert len(tracker) == tracker.capacity == 100
+    assert_within_bounds(tracker, exact, epsilon)
+    assert [d for d, _ in tracker.top(5)] == [d for d, _ in exact.most_common(5)]
+
+
+def test_merge_keeps_error_bounds():
+    epsilon = 0.01
+    stream = skewed_stream(40000, seed=7)
+    parts = [topk.SpaceSaving(epsilon) for _ in range(4)]
+    for i, (domain, weight) in enumerate(stream):
+        parts[i % 4].update(domain, weight)
+
+    merged = topk.SpaceSaving(epsilon)
+    for part in parts:
+        merged.merge(part)
+
+    exact = exact_counts(stream)
+    assert_within_bounds(merged, exact, epsilon)
+    assert [d for d, _ in merged.top(3)] == [d for d, _ in exact.most_common(3)]
+
+
+def test_merge_of_exact_summaries_stays_exact():
+    a = topk.SpaceSaving(epsilon=0.1)
+    b = topk.SpaceSaving(epsilon=0.1)
+    a.update("a.com", 3, "productive")
+    b.update("a.com", 4)
+    b.update("b.com", 2, "distraction")
+
+    a.merge(b)
+    assert a.exact
+    assert a.counts == {"a.com": 7, "b.com": 2}
+    assert a.labels == {"a.com": "productive", "b.com": "distraction"}
+
+
+def test_state_round_trip():
+    tracker = topk.SpaceSaving(epsilon=0.05)
+    for domain, weight in skewed_stream(5000):
+        tracker.update(domain, weight, "neutral")
+
+    restored = topk.SpaceSaving.from_state(*tracker.state())
+    assert restored.counts == tracker.counts
+    assert restored.errors == tracker.errors
+    assert restored.labels == tracker.labels
+    assert (restored.total, restored.exact) == (tracker.total, tracker.exact)
+    restored.update("new.com", 1)
+    assert len(restored) == restored.capacity
+
+
+def test_invalid_epsilon():
+    with pytest.raises(ValueError):
+        topk.SpaceSaving(epsilon=0)
+
+
+def test_top_domains_matches_exact_computation():
+    activities = [
+        {"domain": "a.com", "duration": 30, "category": "productive"},
+        {"domain": "b.com", "duration": 50, "category": "distraction"},
+        {"domain": "a.com", "duration": 30, "category": "neutral"},
+    ]
+    assert topk.top_domains(activities, k=5) == [
+        ("a.com", {"duration": 60, "category": "productive"}),
+        ("b.com", {"duration": 50, "category": "distraction"}),
+    ]
+
+
+def test_daily_trackers_respect_retention():
+    today = date(2024, 3, 1)
+    trackers = topk.DomainTrackers(epsilon=0.1, retention_days=3)
+    for offset in range(10):
+        trackers.track(1, "a.com", 10, "productive", today - timedelta(days=offset), today=today)
+
+    assert sorted(trackers.daily[1]) == [today - timedelta(days=d) for d in (3, 2, 1, 0)]
+    # 過期的天數仍計入總計
+    assert trackers.query(1).total == 100
+    assert trackers.query(1, start=today - timedelta(days=1), end=today).total == 20
+
+
+def test_future_days_only_count_towards_overall():
+    today = date(2024, 3, 1)
+    trackers = topk.DomainTrackers(epsilon=0.1, retention_days=3)
+    for offset in range(1, 400):
+        trackers.track(1, "a.com", 1, "productive", today + timedelta(days=offset), today=today)
+
+    # 用戶端時區差異只容許到明天，更晚的日期不會建立每日統計
+    assert sorted(trackers.daily[1]) == [today + timedelta(days=1)]
+    assert trackers.query(1).total == 399
+    assert len(list(trackers.export(today=today))) == 2
+
+
+def test_ranges_outside_retention_are_not_covered():
+    today = date(2024, 3, 1)
+    trackers = topk.DomainTrackers(epsilon=0.1, retention_days=3)
+    cutoff = today - timedelta(days=3)
+    assert trackers.covers(today=today)
+    assert trackers.covers(cutoff, today, today=today)
+    assert trackers.covers(cutoff, today=today)
+    assert trackers.covers(today, today + timedelta(days=1), today=today)
+    assert not trackers.covers(cutoff - timedelta(days=1), today, today=today)
+    assert not trackers.covers(end=today, today=today)
+    assert not trackers.covers(today, today + timedelta(days=2), today=today)
+
+
+def test_trackers_persist_through_snapshot(tmp_path):
+    today = date.today()
+    trackers = topk.DomainTrackers(epsilon=0.1, retention_days=5)
+    for i, (domain, weight) in enumerate(skewed_stream(2000)):
+        trackers.track(i % 3 + 1, domain, weight, "neutral", today - timedelta(days=i % 4))
+
+    path = str(tmp_path / "activities.snap")
+    snapshot.save(path, [], trackers.export())
+    base = snapshot.load(path, verify=True).base
+    assert sorted(base.tracker_users()) == [1, 2, 3]
+
+    restored = topk.DomainTrackers(epsilon=0.1, retention_days=5, source=base)
+    for user_id in (1, 2, 3):
+        before, after = trackers.query(user_id), restored.query(user_id)
+        assert after.counts == before.counts and after.total == before.total
+        assert sorted(restored.daily[user_id]) == sorted(trackers.daily[user_id])
+
+    # 載入後繼續寫入的資料會與保存的統計合併
+    restored.track(1, "late.com", 5, "productive", today)
+    assert restored.query(1).total == trackers.query(1).total + 5
@@ -0,0 +1,326 @@
+"""
+熱門網域統計模組 - 以 Space-Saving 演算法在固定記憶體內追蹤前幾名網域
+
+最多保留 capacity = ceil(1 / epsilon) 個網域。只要不同網域數沒超過 capacity，
+結果就是精確值；超過之後，每個網域的估計值最多高估 epsilon * 總秒數，
+且真正超過這個比例的網域一定會被保留。多個統計（不同天、不同 worker）可以合併。
+"""
+
+import heapq
+import math
+import threading
+from datetime import date, timedelta
+from typing import Dict, Hashable, Iterator, List, Optional, Tuple
+
+DEFAULT_EPSILON = 0.01
+DEFAULT_RETENTION_DAYS = 30
+FUTURE_DAYS = 1  # 每日統計最多接受到今天之後幾天，容許用戶端的時區差異
+
+
+class SpaceSaving:
+    """加權 Space-Saving 統計，以 lazy heap 找出目前最小的計數"""
+
+    def __init__(self, epsilon: float = DEFAULT_EPSILON, capacity: Optional[int] = None):
+        if capacity is None:
+            if not 0 < epsilon <= 1:
+                raise ValueError("epsilon 必須介於 0 與 1 之間")
+            capacity = math.ceil(1 / epsilon)
+        if capacity < 1:
+            raise ValueError("capacity 至少為 1")
+        self.capacity = capacity
+        self.counts: Dict[Hashable, int] = {}
+        self.errors: Dict[Hashable, int] = {}
+        self.labels: Dict[Hashable, str] = {}
+        self.total = 0
+        self.exact = True
+        self._heap: List[Tuple[int, Hashable]] = []
+
+    def __len__(self) -> int:
+        return len(self.counts)
+
+    def update(self, item: Hashable, weight: int = 1, label: Optional[str] = None) -> None:
+        """
+        累加一個網域的權重（例如停留秒數）
+
+        Args:
+            item: 網域
+            weight: 權重，小於等於 0 時忽略
+            label: 附帶的標記（例如分類），只記錄第一次出現的值
+        """
+        if weight <= 0:
+            return
+        self.total += weight
+        counts = self.counts
+
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.capacity:
+            counts[item] = weight
+            self.errors[item] = 0
+        else:
+            min_count, victim = self._pop_min()
+            del counts[victim]
+            del self.errors[victim]
+            self.labels.pop(victim, None)
+            counts[item] = min_count + weight
+            self.errors[item] = min_count
+            self.exact = False
+
+        if label is not None and item not in self.labels:
+            self.labels[item] = label
+        self._push(counts[item], item)
+
+    def _push(self, count: int, item: Hashable) -> None:
+        heap = self._heap
+        heapq.heappush(heap, (count, item))
+        if len(heap) > 4 * self.capacity + 16:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self) -> None:
+        self._heap = [(count, item) for item, count in self.counts.items()]
+        heapq.heapify(self._heap)
+
+    def _pop_min(self) -> Tuple[int, Hashable]:
+        # 計數只會增加，所以與目前計數相同的項目就是有效的那一筆
+        heap = self._heap
+        while True:
+            count, item = heapq.heappop(heap)
+            if self.counts.get(item) == count:
+                return count, item
+
+    def min_count(self) -> int:
+        """統計已滿時，未被保留的網域最多可能有的計數；未滿時為 0"""
+        if len(self.counts) < self.capacity:
+            return 0
+        return min(self.counts.values())
+
+    def top(self, k: int) -> List[Tuple[Hashable, int]]:
+        """依估計計數由大到小回傳前 k 名 (網域, 計數)"""
+        return heapq.nlargest(k, self.counts.items(), key=lambda x: x[1])
+
+    def error(self, item: Hashable) -> int:
+        """某網域估計值的最大高估量；精確模式下為 0"""
+        error = self.errors.get(item)
+        return self.min_count() if error is None else error
+
+    def state(self) -> Tuple[int, int, bool, List[Tuple[Hashable, int, int, Optional[str]]]]:
+        """
+        匯出 (capacity, total, exact, [(網域, 計數, 誤差, 標記), ...])
+
+        各個 dict 都先整份複製，其他執行緒同時更新時也不會在走訪中途出錯；
+        複製之間被逐出的網域以計數本身作為誤差，估計值仍然是上限。
+        """
+        counts = dict(self.counts)
+        errors = dict(self.errors)
+        labels = dict(self.labels)
+        entries = [
+            (item, count, errors.get(item, count), labels.get(item))
+            for item, count in counts.items()
+        ]
+        return self.capacity, self.total, self.exact, entries
+
+    @classmethod
+    def from_state(cls, capacity: int, total: int, exact: bool, entries) -> "SpaceSaving":
+        """由 state() 匯出的資料重建統計"""
+        tracker = cls(capacity=capacity)
+        for item, count, error, label in entries:
+            tracker.counts[item] = count
+            tracker.errors[item] = error
+            if label is not None:
+                tracker.labels[item] = label
+        tracker.total = total
+        tracker.exact = exact
+        tracker._rebuild_heap()
+        return tracker
+
+    def merge(self, other: "SpaceSaving") -> "SpaceSaving":
+        """
+        將另一份統計併入目前的統計（結果以自身的 capacity 為準）
+
+        不在某一方的網域，以該方的 min_count 作為計數上限補上，誤差界限仍然成立。
+        """
+        self_min = self.min_count()
+        other_min = other.min_count()
+        merged = {}
+        for item in self.counts.keys() | other.counts.keys():
+            merged[item] = (
+                self.counts.get(item, self_min) + other.counts.get(item, other_min),
+                self.errors.get(item, self_min) + other.errors.get(item, other_min),
+            )
+
+        self.exact = self.exact and other.exact and len(merged) <= self.capacity
+        if len(merged) > self.capacity:
+            kept = heapq.nlargest(self.capacity, merged.items(), key=lambda x: x[1][0])
+        else:
+            kept = merged.items()
+
+        for item, label in other.labels.items():
+            self.labels.setdefault(item, label)
+        self.counts = {item: count for item, (count, _) in kept}
+        self.errors = {item: merged[item][1] for item in self.counts}
+        self.labels = {item: self.labels[item] for item in self.counts if item in self.labels}
+        self.total += other.total
+        self._rebuild_heap()
+        return self
+
+
+class DomainTrackers:
+    """
+    每位用戶一份總計，加上最近 retention_days 天的每日統計
+
+    超過保留期限、或晚於今天 FUTURE_DAYS 天以上（用戶端時間錯誤）的活動只計入總計，
+    所以記憶體上限為用戶數 × (retention_days + FUTURE_DAYS + 2) × capacity。
+    source（例如快照）提供先前保存的統計，
+    每位用戶第一次被存取時才載入，並與之後寫入的統計合併。
+    """
+
+    def __init__(
+        self,
+        epsilon: float = DEFAULT_EPSILON,
+        retention_days: int = DEFAULT_RETENTION_DAYS,
+        source=None,
+    ):
+        self.epsilon = epsilon
+        self.retention_days = retention_days
+        self.source = source
+        self.overall: Dict[int, SpaceSaving] = {}
+        self.daily: Dict[int, Dict[date, SpaceSaving]] = {}
+        self._loaded = set()
+        self._load_lock = threading.Lock()
+
+    def _new(self) -> SpaceSaving:
+        return SpaceSaving(self.epsilon)
+
+    def _cutoff(self, today: Optional[date]) -> date:
+        return (today or date.today()) - timedelta(days=self.retention_days)
+
+    def _latest(self, today: Optional[date]) -> date:
+        return (today or date.today()) + timedelta(days=FUTURE_DAYS)
+
+    def _load(self, user_id: int) -> None:
+        source = self.source
+        if source is None or user_id in self._loaded:
+            return
+        with self._load_lock:
+            if user_id in self._loaded:
+                return
+            persisted = source.domain_trackers(user_id)
+            cutoff, latest = self._cutoff(None), self._latest(None)
+            for day, capacity, total, exact, entries in persisted:
+                if day is not None and not cutoff <= day <= latest:
+                    continue
+                tracker = SpaceSaving.from_state(capacity, total, exact, entries)
+                if day is None:
+                    target, key = self.overall, user_id
+                else:
+                    target, key = self.daily.setdefault(user_id, {}), day
+                live = target.get(key)
+                target[key] = tracker.merge(live) if live else tracker
+            self._loaded.add(user_id)
+
+    def detach_source(self) -> None:
+        """來源損毀時停止載入，已載入的統計保留"""
+        self.source = None
+
+    def track(
+        self,
+        user_id: int,
+        domain: str,
+        duration: int,
+        category: str,
+        day: Optional[date] = None,
+        today: Optional[date] = None,
+    ) -> None:
+        """將一筆活動計入總計；day 在保留範圍內時也計入當日統計"""
+        self._load(user_id)
+        tracker = self.overall.get(user_id)
+        if tracker is None:
+            tracker = self.overall[user_id] = self._new()
+        tracker.update(domain, duration, category)
+
+        if day is None:
+            return
+        cutoff = self._cutoff(today)
+        if not cutoff <= day <= self._latest(today):
+            return
+        days = self.daily.setdefault(user_id, {})
+        tracker = days.get(day)
+        if tracker is None:
+            for old in [d for d in days if d < cutoff]:
+                del days[old]
+            tracker = days[day] = self._new()
+        tracker.update(domain, duration, category)
+
+    def covers(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        today: Optional[date] = None,
+    ) -> bool:
+        """
+        query(start, end) 的結果是否涵蓋區間內的所有活動
+
+        只指定 end，或 start 早於保留期限、end 晚於今天 FUTURE_DAYS 天以上時，
+        區間超出每日統計的保留範圍，結果會缺少那些天。不指定區間時查詢的是總計，一律涵蓋。
+        """
+        if start is None and end is None:
+            return True
+        if start is None or start < self._cutoff(today):
+            return False
+        return end is None or end <= self._latest(today)
+
+    def query(
+        self,
+        user_id: int,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+    ) -> SpaceSaving:
+        """取得總計，或合併 [start, end]（含）區間內每日統計的結果"""
+        self._load(user_id)
+        if start is None and end is None:
+            return self.overall.get(user_id) or self._new()
+        result = self._new()
+        for day, tracker in list(self.daily.get(user_id, {}).items()):
+            if (start is None or day >= start) and (end is None or day <= end):
+                result.merge(tracker)
+        return result
+
+    def export(self, today: Optional[date] = None) -> Iterator[Tuple]:
+        """
+        依用戶匯出 (user_id, day 或 None, capacity, total, exact, entries)，day 為 None 表示總計
+
+        尚未載入的用戶直接沿用 source 中的資料；可以在其他執行緒中呼叫。
+        """
+        cutoff, latest = self._cutoff(today), self._latest(today)
+        source = self.source
+        users = set(list(self.overall))
+        if source is not None:
+            users.update(source.tracker_users())
+        for user_id in sorted(users):
+            if source is not None and user_id not in self._loaded:
+                for day, *state in source.domain_trackers(user_id):
+                    if day is None or cutoff <= day <= latest:
+                        yield (user_id, day, *state)
+                continue
+            overall = self.overall.get(user_id)
+            if overall is not None:
+                yield (user_id, None, *overall.state())
+            for day, tracker in sorted(dict(self.daily.get(user_id, {})).items()):
+                if cutoff <= day <= latest:
+                    yield (user_id, day, *tracker.state())
+
+
+def top_domains(activities, k: int = 5, epsilon: float = DEFAULT_EPSILON) -> List[Tuple[str, Dict]]:
+    """
+    計算停留時間最長的前 k 個網域
+
+    Returns:
+        [(網域, {'duration': 秒數, 'category': 分類}), ...]，依時間由多到少排序
+    """
+    tracker = SpaceSaving(epsilon=epsilon, capacity=max(k, math.ceil(1 / epsilon)))
+    for activity in activities:
+        tracker.update(activity['domain'], activity['duration'], activity['category'])
+    return [
+        (domain, {'duration': duration, 'category': tracker.labels.get(domain, 'neutral')})
+        for domain, duration in tracker.top(k)
+    ]